@@ -1,22 +1,78 @@
-import requests
-from datetime import datetime, timedelta
-from flask import Flask, render_template, request, redirect, url_for, flash
 import os
+
+# Under gevent (GEVENT=1, set by gunicorn.conf.py) blocking socket I/O such as the
+# football-data.org calls and PostgreSQL queries must yield to other requests, so
+# patch before anything else imports socket, ssl or psycopg2
+if os.environ.get('GEVENT') == '1':
+    from gevent import monkey
+    monkey.patch_all()
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests_cache import CachedSession
+from urllib3.util.retry import Retry
+from datetime import datetime, timedelta, timezone
+from flask import Flask, render_template, request, redirect, url_for, flash, session
+from flask_caching import Cache
+import queue
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 import psycopg2
+import psycopg2.extensions
 import psycopg2.extras
+from psycopg2.pool import ThreadedConnectionPool
 from urllib.parse import urlparse
 
 
-# Load environment variables from .env file
-load_dotenv()
-
 # Test mode - allows predictions on finished matches for testing
 TEST_MODE = False  # Turn off test mode to use real API data
 
+# Premier League season: matchdays 1-38
+GAME_WEEKS = tuple(range(1, 39))
+
+# Idle SQLite connections kept for reuse (development database only)
+SQLITE_POOL_SIZE = 4
+
+# football-data.org free tier request quota
+API_CALLS_PER_MINUTE = 10
+
+# Form field for one match's prediction, e.g. prediction_42
+PREDICTION_FIELD = re.compile(r'prediction_(\d+)')
+
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-change-this'  # Change this in production
 
+# Per-process cache for the results pages and the leaderboard/weekly queries behind them;
+# entries are keyed on the data version stored in the database, so a write in any worker
+# makes every worker's old entries unreachable
+cache = Cache(app, config={'CACHE_TYPE': 'SimpleCache', 'CACHE_DEFAULT_TIMEOUT': 60})
+
+
+def has_pending_flash():
+    """Don't serve or store a cached page while a flash message is waiting to be shown"""
+    return '_flashes' in session
+
+
+def results_cache_key():
+    """Cache key for a results page, tied to the current data version"""
+    return f'view/{request.path}/v{db.get_data_version()}'
+
+
+@app.template_filter('kickoff')
+def format_kickoff(match_date):
+    """Format a match date as 'YYYY-MM-DD HH:MM' (datetime on PostgreSQL, unix time on SQLite)"""
+    if isinstance(match_date, int):
+        match_date = datetime.fromtimestamp(match_date, tz=timezone.utc)
+    if isinstance(match_date, datetime):
+        return match_date.strftime('%Y-%m-%d %H:%M')
+    # Rows stored as ISO text before match_date became an integer on SQLite
+    return str(match_date)[:16].replace('T', ' ')
+
 
 import psycopg2
 import psycopg2.extras
@@ -24,6 +80,91 @@ from urllib.parse import urlparse
 import os
 from datetime import datetime
 
+# Hot queries shared by both databases, written with SQLite's ? placeholders. Keeping the
+# text identical across calls lets the pooled SQLite connections reuse their parsed
+# statements from the sqlite3 statement cache.
+_SQL_PREDICTIONS_PAGE = '''
+    SELECT pl.name AS player_name, m.id, m.home_team, m.away_team, m.match_date, m.status,
+           m.result, m.home_score, m.away_score, COALESCE(p.prediction, '') AS prediction
+    FROM players pl
+    LEFT JOIN matches m ON m.game_week = ?
+    LEFT JOIN predictions p ON p.match_id = m.id AND p.player_id = pl.id
+    WHERE pl.id = ?
+    ORDER BY m.match_date
+'''
+
+_SQL_WEEKLY = '''
+    SELECT 
+        pl.name as player_name,
+        COALESCE(s.points, 0) as weekly_points
+    FROM players pl
+    LEFT JOIN (
+        SELECT p.player_id, SUM(p.points_earned) as points
+        FROM predictions p
+        JOIN matches m ON p.match_id = m.id
+        WHERE m.game_week = ?
+        GROUP BY p.player_id
+    ) s ON s.player_id = pl.id
+    ORDER BY weekly_points DESC, player_name
+'''
+
+_SQL_CUMULATIVE = '''
+    SELECT 
+        pl.name as player_name,
+        COALESCE(s.points, 0) as total_points
+    FROM players pl
+    LEFT JOIN (
+        SELECT p.player_id, SUM(p.points_earned) as points
+        FROM predictions p
+        JOIN matches m ON p.match_id = m.id
+        WHERE m.game_week <= ?
+        GROUP BY p.player_id
+    ) s ON s.player_id = pl.id
+    ORDER BY total_points DESC, player_name
+'''
+
+# SQLite has no points view, so its leaderboard sums predictions directly
+_SQL_LEADERBOARD = '''
+    SELECT 
+        pl.name as player_name,
+        COALESCE(SUM(p.points_earned), 0) as total_points
+    FROM players pl
+    LEFT JOIN predictions p ON pl.id = p.player_id
+    LEFT JOIN matches m ON p.match_id = m.id
+    GROUP BY pl.id, pl.name
+    ORDER BY total_points DESC, player_name
+'''
+
+
+def _numbered_params(sql):
+    """Rewrite ? placeholders as PostgreSQL's $1, $2, ... for PREPARE"""
+    count = iter(range(1, sql.count('?') + 1))
+    return re.sub(r'\?', lambda _: f'${next(count)}', sql)
+
+
+# Hot PostgreSQL queries, PREPAREd once per pooled connection and run with EXECUTE
+# so each request skips parsing and planning. Needs session pooling if PgBouncer is used.
+PREPARED_STATEMENTS = {
+    'predictions_page': _numbered_params(_SQL_PREDICTIONS_PAGE),
+    'weekly_points': _numbered_params(_SQL_WEEKLY),
+    'cumulative_points': _numbered_params(_SQL_CUMULATIVE),
+    'leaderboard': '''
+        SELECT 
+            pl.name as player_name,
+            COALESCE(SUM(v.points), 0) as total_points
+        FROM players pl
+        LEFT JOIN player_points_by_gw v ON v.player_id = pl.id
+        GROUP BY pl.id, pl.name
+        ORDER BY total_points DESC, player_name
+    ''',
+}
+
+
+class PreparedConnection(psycopg2.extensions.connection):
+    """Pooled connection that remembers whether PREPARED_STATEMENTS exist on it"""
+    statements_prepared = False
+
+
 class Database:
     def __init__(self):
         # Get database URL from environment variable
@@ -31,19 +172,89 @@ class Database:
         if self.database_url:
             # Production: Use PostgreSQL
             self.use_postgres = True
+            # Reuse connections across requests instead of reconnecting every time
+            # DictCursor rows can be read by column name as well as by position
+            pool_size = int(os.environ.get('DB_POOL_SIZE', 10))
+            self.pool = ThreadedConnectionPool(minconn=2, maxconn=pool_size, dsn=self.database_url,
+                                               connection_factory=PreparedConnection,
+                                               cursor_factory=psycopg2.extras.DictCursor)
+            # getconn() raises once the pool is exhausted; this makes callers wait instead
+            # (threading is gevent-aware once monkey-patched, so greenlets yield here)
+            self.pool_slots = threading.BoundedSemaphore(pool_size)
         else:
             # Development: Use SQLite
             self.use_postgres = False
             self.db_path = "premier_league_predictions.db"
+            # Idle connections kept open between requests (the dev server runs each
+            # request on a new thread, so they can't be tied to a thread)
+            self.sqlite_pool = queue.LifoQueue(maxsize=SQLITE_POOL_SIZE)
         
+        # Statements can only be prepared once the tables they reference exist
+        self.schema_ready = False
         self.init_database()
+        self.schema_ready = True
     
     def get_connection(self):
         if self.use_postgres:
-            return psycopg2.connect(self.database_url)
+            self.pool_slots.acquire()
+            try:
+                conn = self.pool.getconn()
+            except Exception:
+                self.pool_slots.release()
+                raise
+            # Group each unit of work into one explicit transaction
+            conn.autocommit = False
+            if self.schema_ready and not conn.statements_prepared:
+                self.prepare_statements(conn)
+            return conn
+        else:
+            try:
+                return self.sqlite_pool.get_nowait()
+            except queue.Empty:
+                return self.connect_sqlite()
+    
+    def connect_sqlite(self):
+        """Open a new SQLite connection (WAL mode itself is set once, in init_database)"""
+        import sqlite3
+        # Pooled connections move between request threads, one thread at a time
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        # Same name-or-position row access as DictCursor on PostgreSQL
+        conn.row_factory = sqlite3.Row
+        # Per-connection settings trading durability/memory for speed
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA mmap_size=268435456')
+        return conn
+    
+    def get_read_connection(self):
+        """Get a connection for SELECT-only work (release it with put_connection)"""
+        conn = self.get_connection()
+        if self.use_postgres:
+            # Autocommit skips the implicit BEGIN/COMMIT around single-query reads
+            conn.autocommit = True
+        return conn
+    
+    def prepare_statements(self, conn):
+        """PREPARE the hot queries on a fresh pooled connection (they last for its session)"""
+        cursor = conn.cursor()
+        for name, sql in PREPARED_STATEMENTS.items():
+            cursor.execute(f'PREPARE {name} AS {sql}')
+        conn.commit()
+        conn.statements_prepared = True
+    
+    def put_connection(self, conn):
+        """Return a connection obtained from get_connection"""
+        if self.use_postgres:
+            self.pool.putconn(conn)
+            self.pool_slots.release()
         else:
-            import sqlite3
-            return sqlite3.connect(self.db_path)
+            # Never hand an unfinished transaction to the next borrower
+            if conn.in_transaction:
+                conn.rollback()
+            try:
+                self.sqlite_pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
     
     def init_database(self):
         """Initialize database tables"""
@@ -51,6 +262,9 @@ class Database:
         cursor = conn.cursor()
         
         if self.use_postgres:
+            # Serialize schema setup when several workers start at once (released on commit)
+            cursor.execute('SELECT pg_advisory_xact_lock(42)')
+            
             # PostgreSQL syntax
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS players (
@@ -97,7 +311,25 @@ class Database:
                     UNIQUE(player_id, match_id)
                 )
             ''')
+            
+            # Points per player per gameweek, refreshed whenever points_earned changes
+            cursor.execute('''
+                CREATE MATERIALIZED VIEW IF NOT EXISTS player_points_by_gw AS
+                SELECT p.player_id, m.game_week, SUM(p.points_earned) AS points
+                FROM predictions p
+                JOIN matches m ON p.match_id = m.id
+                GROUP BY p.player_id, m.game_week
+                WITH DATA
+            ''')
+            # Unique index is required for REFRESH ... CONCURRENTLY
+            cursor.execute('''
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_player_points_by_gw
+                ON player_points_by_gw(player_id, game_week)
+            ''')
         else:
+            # WAL lets readers run alongside a writer; it is stored in the database file
+            cursor.execute('PRAGMA journal_mode=WAL')
+            
             # SQLite syntax (for local development)
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS players (
@@ -124,7 +356,7 @@ class Database:
                     game_week INTEGER,
                     home_team VARCHAR(100),
                     away_team VARCHAR(100),
-                    match_date TIMESTAMP,
+                    match_date INTEGER,
                     home_score INTEGER DEFAULT NULL,
                     away_score INTEGER DEFAULT NULL,
                     result VARCHAR(10) DEFAULT NULL,
@@ -147,205 +379,212 @@ class Database:
                 )
             ''')
         
+        # Single-row counter bumped by every write that can change points. It lives in the
+        # database so all workers see it; the results cache keys include it.
+        cursor.execute('CREATE TABLE IF NOT EXISTS data_version (id INTEGER PRIMARY KEY, version INTEGER NOT NULL)')
+        cursor.execute('INSERT INTO data_version (id, version) VALUES (1, 0) ON CONFLICT (id) DO NOTHING')
+        
+        # Indexes for the gameweek filters and the predictions joins (same syntax on both)
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_matches_gw ON matches(game_week)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_matches_result ON matches(game_week) WHERE result IS NOT NULL')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_predictions_player ON predictions(player_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_predictions_match ON predictions(match_id)')
+        # (player_id, match_id) lookups already use the index behind the UNIQUE constraint
+        
+        # Refresh planner statistics so joins start from the right table and index
+        cursor.execute('ANALYZE')
+        
         conn.commit()
-        conn.close()
+        self.put_connection(conn)
         print(f"Database initialized ({'PostgreSQL' if self.use_postgres else 'SQLite'})")
     
+    def get_data_version(self):
+        """Current data version, shared by all workers through the database"""
+        conn = self.get_read_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT version FROM data_version WHERE id = 1')
+        version = cursor.fetchone()[0]
+        self.put_connection(conn)
+        return version
+    
+    def bump_data_version(self, cursor):
+        """Make every worker's cached results stale (call inside the writing transaction)"""
+        cursor.execute('UPDATE data_version SET version = version + 1 WHERE id = 1')
+    
+    @cache.memoize(timeout=3600)
     def get_all_players(self):
         """Get all players"""
-        conn = self.get_connection()
+        conn = self.get_read_connection()
         cursor = conn.cursor()
         cursor.execute('SELECT id, name FROM players ORDER BY name')
-        players = cursor.fetchall()
-        conn.close()
+        # Plain tuples so the memoized result can be pickled into the cache
+        players = [tuple(row) for row in cursor.fetchall()]
+        self.put_connection(conn)
         return players
     
     def get_matches_by_gameweek(self, game_week):
-        """Get all matches for a specific game week"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-    
-        if self.use_postgres:
-            cursor.execute('''
-                SELECT id, home_team, away_team, 
-                        TO_CHAR(match_date, 'YYYY-MM-DD HH24:MI') as match_date_str,
-                        status, result, home_score, away_score
-                FROM matches 
-                WHERE game_week = %s 
-                ORDER BY match_date
-            ''', (game_week,))
-        else:
-            cursor.execute('''
-                SELECT id, home_team, away_team, match_date, status, result, home_score, away_score
-                FROM matches 
-                WHERE game_week = ? 
-                ORDER BY match_date
-            ''', (game_week,))
-    
-        matches = cursor.fetchall()
-        conn.close()
-        return matches
+        """Yield all matches for a specific game week (wrap in list() to reuse them)"""
+        conn = self.get_read_connection()
+        try:
+            if self.use_postgres:
+                # Server-side cursor streams rows in batches instead of one fetchall()
+                # (the read connection autocommits, so it has to be declared WITH HOLD)
+                cursor = conn.cursor(name='matches_gw_cur', withhold=True)
+                cursor.itersize = 64
+                cursor.execute('''
+                    SELECT id, home_team, away_team, match_date, status, result, home_score, away_score
+                    FROM matches 
+                    WHERE game_week = %s 
+                    ORDER BY match_date
+                ''', (game_week,))
+            else:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT id, home_team, away_team, match_date, status, result, home_score, away_score
+                    FROM matches 
+                    WHERE game_week = ? 
+                    ORDER BY match_date
+                ''', (game_week,))
+            
+            yield from cursor
+            cursor.close()
+        finally:
+            self.put_connection(conn)
     
     def get_weekly_results(self, game_week):
         """Get weekly results for all players in a specific gameweek"""
-        conn = self.get_connection()
+        return self._get_weekly_results(game_week, self.get_data_version())
+    
+    @cache.memoize(timeout=300)
+    def _get_weekly_results(self, game_week, version):
+        conn = self.get_read_connection()
         cursor = conn.cursor()
         
-        # Auto-calculate points first
-        self.calculate_points_for_gameweek(game_week)
-        
+        # Filter the gameweek inside the aggregate so the game_week index can be used,
+        # then LEFT JOIN players so everyone is listed even with no points
         if self.use_postgres:
             # Get weekly points - PostgreSQL
-            cursor.execute('''
-                SELECT 
-                    pl.name as player_name,
-                    COALESCE(SUM(p.points_earned), 0) as weekly_points
-                FROM players pl
-                LEFT JOIN predictions p ON pl.id = p.player_id
-                LEFT JOIN matches m ON p.match_id = m.id
-                WHERE m.game_week = %s OR m.game_week IS NULL
-                GROUP BY pl.id, pl.name
-                ORDER BY weekly_points DESC, player_name
-            ''', (game_week,))
+            cursor.execute('EXECUTE weekly_points(%s)', (game_week,))
             
             weekly_results = cursor.fetchall()
             
             # Get cumulative points - PostgreSQL
-            cursor.execute('''
-                SELECT 
-                    pl.name as player_name,
-                    COALESCE(SUM(p.points_earned), 0) as total_points
-                FROM players pl
-                LEFT JOIN predictions p ON pl.id = p.player_id
-                LEFT JOIN matches m ON p.match_id = m.id
-                WHERE m.game_week <= %s OR m.game_week IS NULL
-                GROUP BY pl.id, pl.name
-                ORDER BY total_points DESC, player_name
-            ''', (game_week,))
+            cursor.execute('EXECUTE cumulative_points(%s)', (game_week,))
             
         else:
             # SQLite syntax
-            cursor.execute('''
-                SELECT 
-                    pl.name as player_name,
-                    COALESCE(SUM(p.points_earned), 0) as weekly_points
-                FROM players pl
-                LEFT JOIN predictions p ON pl.id = p.player_id
-                LEFT JOIN matches m ON p.match_id = m.id
-                WHERE m.game_week = ? OR m.game_week IS NULL
-                GROUP BY pl.id, pl.name
-                ORDER BY weekly_points DESC, player_name
-            ''', (game_week,))
+            cursor.execute(_SQL_WEEKLY, (game_week,))
             
             weekly_results = cursor.fetchall()
             
-            cursor.execute('''
-                SELECT 
-                    pl.name as player_name,
-                    COALESCE(SUM(p.points_earned), 0) as total_points
-                FROM players pl
-                LEFT JOIN predictions p ON pl.id = p.player_id
-                LEFT JOIN matches m ON p.match_id = m.id
-                WHERE m.game_week <= ? OR m.game_week IS NULL
-                GROUP BY pl.id, pl.name
-                ORDER BY total_points DESC, player_name
-            ''', (game_week,))
+            cursor.execute(_SQL_CUMULATIVE, (game_week,))
         
         cumulative_results = cursor.fetchall()
-        conn.close()
-        return weekly_results, cumulative_results
+        self.put_connection(conn)
+        # Plain tuples so the memoized result can be pickled into the cache
+        return [tuple(row) for row in weekly_results], [tuple(row) for row in cumulative_results]
     
     def get_overall_leaderboard(self):
         """Get overall leaderboard across all gameweeks"""
-        conn = self.get_connection()
+        return self._get_overall_leaderboard(self.get_data_version())
+    
+    @cache.memoize(timeout=300)
+    def _get_overall_leaderboard(self, version):
+        conn = self.get_read_connection()
         cursor = conn.cursor()
         
-        cursor.execute('''
-            SELECT 
-                pl.name as player_name,
-                COALESCE(SUM(p.points_earned), 0) as total_points
-            FROM players pl
-            LEFT JOIN predictions p ON pl.id = p.player_id
-            LEFT JOIN matches m ON p.match_id = m.id
-            GROUP BY pl.id, pl.name
-            ORDER BY total_points DESC, player_name
-        ''')
-        
-        results = cursor.fetchall()
-        conn.close()
+        if self.use_postgres:
+            # Read the precomputed per-gameweek totals
+            cursor.execute('EXECUTE leaderboard')
+        else:
+            cursor.execute(_SQL_LEADERBOARD)
+        
+        results = [tuple(row) for row in cursor.fetchall()]
+        self.put_connection(conn)
         return results
     
-    def calculate_points_for_gameweek(self, game_week):
-        """Calculate and update points for all predictions in a gameweek"""
-        conn = self.get_connection()
+    def calculate_points_for_gameweek(self, game_week, conn):
+        """Calculate and update points for all predictions in a gameweek (caller commits)"""
         cursor = conn.cursor()
         
+        # Nothing to score until at least one match has a result (probe on idx_matches_result)
+        if self.use_postgres:
+            cursor.execute('SELECT 1 FROM matches WHERE game_week = %s AND result IS NOT NULL LIMIT 1', (game_week,))
+        else:
+            cursor.execute('SELECT 1 FROM matches WHERE game_week = ? AND result IS NOT NULL LIMIT 1', (game_week,))
+        if cursor.fetchone() is None:
+            return 0
+        
+        # One set-based UPDATE ... FROM join, touching only predictions whose points are wrong
         if self.use_postgres:
             cursor.execute('''
-                SELECT p.id, p.prediction, m.result, p.player_id, m.home_team, m.away_team
-                FROM predictions p
-                JOIN matches m ON p.match_id = m.id
-                WHERE m.game_week = %s AND m.result IS NOT NULL
+                UPDATE predictions
+                SET points_earned = CASE WHEN predictions.prediction = m.result THEN 1 ELSE 0 END
+                FROM matches m
+                WHERE predictions.match_id = m.id AND m.game_week = %s AND m.result IS NOT NULL
+                  AND predictions.points_earned <> CASE WHEN predictions.prediction = m.result THEN 1 ELSE 0 END
             ''', (game_week,))
-            
-            predictions_to_update = cursor.fetchall()
-            
-            for pred_id, prediction, actual_result, player_id, home_team, away_team in predictions_to_update:
-                points = 1 if prediction == actual_result else 0
-                cursor.execute('''
-                    UPDATE predictions 
-                    SET points_earned = %s
-                    WHERE id = %s
-                ''', (points, pred_id))
         else:
+            # UPDATE ... FROM needs SQLite 3.33+
             cursor.execute('''
-                SELECT p.id, p.prediction, m.result, p.player_id, m.home_team, m.away_team
-                FROM predictions p
-                JOIN matches m ON p.match_id = m.id
-                WHERE m.game_week = ? AND m.result IS NOT NULL
+                UPDATE predictions
+                SET points_earned = CASE WHEN predictions.prediction = m.result THEN 1 ELSE 0 END
+                FROM matches m
+                WHERE predictions.match_id = m.id AND m.game_week = ? AND m.result IS NOT NULL
+                  AND predictions.points_earned <> CASE WHEN predictions.prediction = m.result THEN 1 ELSE 0 END
             ''', (game_week,))
-            
-            predictions_to_update = cursor.fetchall()
-            
-            for pred_id, prediction, actual_result, player_id, home_team, away_team in predictions_to_update:
-                points = 1 if prediction == actual_result else 0
-                cursor.execute('''
-                    UPDATE predictions 
-                    SET points_earned = ?
-                    WHERE id = ?
-                ''', (points, pred_id))
+        updated = cursor.rowcount
         
-        conn.commit()
-        conn.close()
+        if updated and self.use_postgres:
+            self.refresh_points_view(cursor)
         
-        return len(predictions_to_update)
-    
+        return updated
+
+    def refresh_points_view(self, cursor):
+        """Rebuild the player_points_by_gw materialized view (PostgreSQL only)"""
+        # CONCURRENTLY keeps the view readable by the leaderboard while it refreshes
+        cursor.execute('REFRESH MATERIALIZED VIEW CONCURRENTLY player_points_by_gw')
+
     def add_default_players(self):
         """Add the 6 players to the database"""
         players = ["Biniam A", "Biniam G", "Biniam E", "Abel", "Siem", "Kubrom"]
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        for player in players:
-            try:
-                if self.use_postgres:
-                    cursor.execute('INSERT INTO players (name) VALUES (%s) ON CONFLICT (name) DO NOTHING', (player,))
-                else:
-                    cursor.execute('INSERT OR IGNORE INTO players (name) VALUES (?)', (player,))
-            except Exception as e:
-                print(f"Error adding player {player}: {e}")
-                continue
+        # One multi-row INSERT in a single transaction
+        try:
+            if self.use_postgres:
+                psycopg2.extras.execute_values(
+                    cursor, 'INSERT INTO players (name) VALUES %s ON CONFLICT (name) DO NOTHING',
+                    [(player,) for player in players])
+            else:
+                cursor.executemany('INSERT OR IGNORE INTO players (name) VALUES (?)',
+                                   [(player,) for player in players])
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            print(f"Error adding players: {e}")
         
-        conn.commit()
-        conn.close()
+        self.put_connection(conn)
+        cache.delete_memoized(self.get_all_players)
         print("Real players added:", players)
 
 class FootballAPI:
     def __init__(self, api_key):
         self.api_key = api_key
-        self.base_url = "http://api.football-data.org/v4"
+        self.base_url = "https://api.football-data.org/v4"
         self.headers = {"X-Auth-Token": api_key}
         self.premier_league_id = 2021
+        
+        # Keep-alive session so repeat fetches reuse the TLS connection, backed by an on-disk
+        # response cache; expired entries are revalidated with ETag/Last-Modified. Kept short
+        # so match statuses (which lock predictions) stay current.
+        self._session = CachedSession('fd_api_cache', backend='sqlite', expire_after=60, cache_control=True)
+        self._session.headers.update(self.headers)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16,
+                              max_retries=Retry(total=3, backoff_factor=0.3))
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
     
     def get_matches_by_matchday(self, matchday):
         """Get matches for a specific matchday (game week)"""
@@ -356,29 +595,85 @@ class FootballAPI:
         }
         
         try:
-            response = requests.get(url, headers=self.headers, params=params)
+            response = self._session.get(url, params=params, timeout=5)
             response.raise_for_status()
-            return response.json()
+            data = response.json()
+            matches = data.get('matches')
+            if not response.from_cache and matches and all(m['status'] == 'FINISHED' for m in matches):
+                # A finished matchday never changes again, so keep it for good (expires=None)
+                self._session.cache.save_response(response, expires=None)
+            return data
         except requests.exceptions.RequestException as e:
             print(f"Error fetching matches for matchday {matchday}: {e}")
             return None
     
+    def prefetch_missing_matchdays(self, db):
+        """Fetch and save every matchday that isn't in the database yet (run off the request path)"""
+        if not db.use_postgres:
+            self._prefetch(db)
+            return
+        
+        # Every gunicorn worker starts this; only the one holding the lock prefetches.
+        # A dedicated connection keeps the session lock without tying up a pool slot.
+        lock_conn = psycopg2.connect(db.database_url)
+        try:
+            cursor = lock_conn.cursor()
+            cursor.execute('SELECT pg_try_advisory_lock(43)')
+            if cursor.fetchone()[0]:
+                self._prefetch(db)
+        finally:
+            lock_conn.close()  # also releases the advisory lock
+    
+    def _prefetch(self, db):
+        conn = db.get_read_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT DISTINCT game_week FROM matches')
+        stored = {row[0] for row in cursor.fetchall()}
+        db.put_connection(conn)
+        
+        missing = [matchday for matchday in GAME_WEEKS if matchday not in stored]
+        if not missing:
+            return
+        
+        print(f"Prefetching {len(missing)} matchdays from API...")
+        # Use at most half of the per-minute API quota, leaving the rest for page views:
+        # fetches start one interval apart, two at a time over the shared session
+        interval = 60 / (API_CALLS_PER_MINUTE / 2)
+        started = time.monotonic()
+        
+        def fetch(slot, matchday):
+            time.sleep(max(0, started + slot * interval - time.monotonic()))
+            return self.get_matches_by_matchday(matchday)
+        
+        # Writes still happen one matchday at a time
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            for matchday, matches_data in zip(missing, pool.map(fetch, range(len(missing)), missing)):
+                self.store_matches(matchday, matches_data, db)
+    
     def save_matches_to_db(self, matchday, db):
         """Fetch matches from API and save to database"""
         print(f"Fetching matchday {matchday} from API...")
         matches_data = self.get_matches_by_matchday(matchday)
+        return self.store_matches(matchday, matches_data, db)
+    
+    def store_matches(self, matchday, matches_data, db):
+        """Save an API matches response to the database; True if any matches were saved"""
         if not matches_data or 'matches' not in matches_data:
             print(f"No matches found for matchday {matchday}")
             return False
         
+        # Only borrowed once the API response is in hand
         conn = db.get_connection()
         cursor = conn.cursor()
         
-        matches_saved = 0
+        rows = []
         for match in matches_data['matches']:
             try:
-                # Parse match date
-                match_date_str = match['utcDate']  # Keep as string
+                # PostgreSQL parses the ISO string into its TIMESTAMP column;
+                # SQLite stores kickoff as an integer unix time
+                match_date = match['utcDate']
+                if not db.use_postgres:
+                    match_date = int(datetime.fromisoformat(match_date[:-1] + '+00:00').timestamp())
                 
                 # Use the ACTUAL status from the API
                 status = match['status']
@@ -402,95 +697,116 @@ class FootballAPI:
                     
                     print(f"  Result: {home_score}-{away_score} = {result}")
                 
-                if db.use_postgres:
-                    # Simple INSERT with manual duplicate handling
-                    cursor.execute('SELECT id FROM matches WHERE api_match_id = %s', (match['id'],))
-                    existing = cursor.fetchone()
-                    
-                    if existing:
-                        # Update existing
-                        cursor.execute('''
-                            UPDATE matches 
-                            SET home_score = %s, away_score = %s, result = %s, status = %s
-                            WHERE api_match_id = %s
-                        ''', (home_score, away_score, result, status, match['id']))
-                    else:
-                        # Insert new
-                        cursor.execute('''
-                            INSERT INTO matches 
-                            (api_match_id, game_week, home_team, away_team, match_date, 
-                             home_score, away_score, result, status)
-                            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                        ''', (
-                            match['id'], matchday, 
-                            match['homeTeam']['name'], match['awayTeam']['name'],
-                            match_date_str, home_score, away_score, result, status
-                        ))
-                else:
-                    cursor.execute('''
-                        INSERT OR REPLACE INTO matches 
-                        (api_match_id, game_week, home_team, away_team, match_date, 
-                         home_score, away_score, result, status)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    ''', (
-                        match['id'], matchday, 
-                        match['homeTeam']['name'], match['awayTeam']['name'],
-                        match_date_str, home_score, away_score, result, status
-                    ))
-                
-                matches_saved += 1
+                rows.append((
+                    match['id'], matchday,
+                    match['homeTeam']['name'], match['awayTeam']['name'],
+                    match_date, home_score, away_score, result, status
+                ))
                 
             except Exception as e:
                 print(f"Error processing match {match.get('id', 'unknown')}: {e}")
                 continue
         
+        # Upsert the whole matchday in one statement. ON CONFLICT keeps the
+        # existing row (and its id) so predictions stay attached to it.
+        if rows:
+            # Results as stored before this refresh, to tell whether any actually changed
+            api_match_ids = [row[0] for row in rows]
+            if db.use_postgres:
+                cursor.execute('SELECT api_match_id, result FROM matches WHERE api_match_id = ANY(%s)',
+                               (api_match_ids,))
+            else:
+                placeholders = ', '.join('?' * len(api_match_ids))
+                cursor.execute(f'SELECT api_match_id, result FROM matches WHERE api_match_id IN ({placeholders})',
+                               api_match_ids)
+            old_results = {api_match_id: result for api_match_id, result in cursor.fetchall()}
+            results_changed = any(old_results.get(row[0]) != row[7] for row in rows)
+            
+            if db.use_postgres:
+                psycopg2.extras.execute_values(cursor, '''
+                    INSERT INTO matches 
+                    (api_match_id, game_week, home_team, away_team, match_date, 
+                     home_score, away_score, result, status)
+                    VALUES %s
+                    ON CONFLICT (api_match_id) DO UPDATE
+                    SET home_score = EXCLUDED.home_score, away_score = EXCLUDED.away_score,
+                        result = EXCLUDED.result, status = EXCLUDED.status
+                ''', rows, page_size=50)
+            else:
+                cursor.executemany('''
+                    INSERT INTO matches 
+                    (api_match_id, game_week, home_team, away_team, match_date, 
+                     home_score, away_score, result, status)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (api_match_id) DO UPDATE
+                    SET home_score = excluded.home_score, away_score = excluded.away_score,
+                        result = excluded.result, status = excluded.status
+                ''', rows)
+            
+            # Points only need recalculating when a result changed (same transaction)
+            if results_changed and db.calculate_points_for_gameweek(matchday, conn=conn):
+                # Results pages are stale now
+                db.bump_data_version(cursor)
+        
         conn.commit()
-        conn.close()
-        print(f"Saved {matches_saved} matches for matchday {matchday}")
-        return matches_saved > 0
-
-# Initialize database and API
-db = Database()
-db.add_default_players()
-
-# Get API key with manual parsing fallback
-API_KEY = os.getenv("FOOTBALL_API_KEY")
-if not API_KEY:
-    try:
-        with open('.env', 'r') as f:
-            for line in f:
-                line = line.strip()
-                if line.startswith('FOOTBALL_API_KEY='):
-                    API_KEY = line.split('=', 1)[1]
-                    break
-    except:
-        pass
-
-api = FootballAPI(API_KEY) if API_KEY else None
+        db.put_connection(conn)
+        print(f"Saved {len(rows)} matches for matchday {matchday}")
+        return len(rows) > 0
+
+# Database and API clients, created once per process by init_services()
+db = None
+api = None
+_initialized = False
+_init_lock = threading.Lock()
+
+def init_services():
+    """Load .env, create tables, add default players and set up the API client (once per process)"""
+    global db, api, _initialized
+    if _initialized:
+        return
+    with _init_lock:
+        if _initialized:
+            return
+        
+        # Load environment variables from .env file
+        load_dotenv()
+        
+        db = Database()
+        db.add_default_players()
+        
+        API_KEY = os.getenv("FOOTBALL_API_KEY")
+        if not API_KEY:
+            print("FOOTBALL_API_KEY not set; match data will not be fetched from the API")
+        
+        api = FootballAPI(API_KEY) if API_KEY else None
+        if api:
+            # Warm up missing matchdays in the background instead of on first page view
+            threading.Thread(target=api.prefetch_missing_matchdays, args=(db,), daemon=True).start()
+        _initialized = True
+
+def create_app():
+    """App factory, e.g. gunicorn 'app:create_app()'"""
+    with app.app_context():
+        init_services()
+    return app
+
+@app.before_request
+def ensure_services():
+    # Covers entry points that import `app` directly instead of calling create_app()
+    init_services()
 
 # Flask Routes
 @app.route('/')
 def home():
     """Home page with player and game week selection"""
     players = db.get_all_players()
-    game_weeks = list(range(1, 39))
-    return render_template('home.html', players=players, game_weeks=game_weeks)
+    return render_template('home.html', players=players, game_weeks=GAME_WEEKS)
 
 @app.route('/predictions/<int:player_id>/<int:game_week>')
 def predictions(player_id, game_week):
     """Predictions page for specific player and game week"""
-    conn = db.get_connection()
-    cursor = conn.cursor()
-    
-    # Get player info
-    if db.use_postgres:
-        cursor.execute('SELECT name FROM players WHERE id = %s', (player_id,))
-    else:
-        cursor.execute('SELECT name FROM players WHERE id = ?', (player_id,))
-    
-    player = cursor.fetchone()
-    
-    if not player:
+    # Check the player (from the cached list) before any API call or write
+    if not any(player[0] == player_id for player in db.get_all_players()):
         flash('Player not found')
         return redirect(url_for('home'))
     
@@ -499,29 +815,20 @@ def predictions(player_id, game_week):
         print(f"Auto-refreshing match data for gameweek {game_week}")
         api.save_matches_to_db(game_week, db)
     
-    # Load matches (now with fresh data)
-    matches = db.get_matches_by_gameweek(game_week)
-    
-    # Get existing predictions for this player and game week
+    # Player name, the gameweek's matches and their existing predictions in one query;
+    # with no matches yet it comes back as a single row of NULL match columns
+    conn = db.get_read_connection()
+    cursor = conn.cursor()
     if db.use_postgres:
-        cursor.execute('''
-            SELECT m.id, COALESCE(p.prediction, '') as prediction
-            FROM matches m
-            LEFT JOIN predictions p ON m.id = p.match_id AND p.player_id = %s
-            WHERE m.game_week = %s
-        ''', (player_id, game_week))
+        cursor.execute('EXECUTE predictions_page(%s, %s)', (game_week, player_id))
     else:
-        cursor.execute('''
-            SELECT m.id, COALESCE(p.prediction, '') as prediction
-            FROM matches m
-            LEFT JOIN predictions p ON m.id = p.match_id AND p.player_id = ?
-            WHERE m.game_week = ?
-        ''', (player_id, game_week))
-    
-    predictions_result = cursor.fetchall()
-    predictions_data = {row[0]: row[1] for row in predictions_result}
+        cursor.execute(_SQL_PREDICTIONS_PAGE, (game_week, player_id))
+    rows = cursor.fetchall()
+    db.put_connection(conn)
     
-    conn.close()
+    player = (rows[0]['player_name'],)
+    matches = [row for row in rows if row['id'] is not None]
+    predictions_data = {row['id']: row['prediction'] for row in matches}
     
     return render_template('predictions.html', 
                          player=player, 
@@ -538,31 +845,41 @@ def submit_predictions():
     
     conn = db.get_connection()
     cursor = conn.cursor()
-    
-    predictions_count = 0
-    for key, value in request.form.items():
-        if key.startswith('prediction_'):
-            match_id = int(key.replace('prediction_', ''))
-            
-            # Simple approach: delete existing, then insert
-            if db.use_postgres:
-                cursor.execute('DELETE FROM predictions WHERE player_id = %s AND match_id = %s', (player_id, match_id))
-                cursor.execute('''
-                    INSERT INTO predictions 
-                    (player_id, match_id, prediction, updated_at)
-                    VALUES (%s, %s, %s, %s)
-                ''', (player_id, match_id, value, datetime.now()))
-            else:
-                cursor.execute('''
-                    INSERT OR REPLACE INTO predictions 
-                    (player_id, match_id, prediction, updated_at)
-                    VALUES (?, ?, ?, ?)
-                ''', (player_id, match_id, value, datetime.now()))
-            
-            predictions_count += 1
-    
+
+    # One batched upsert for the whole gameweek instead of a DELETE + INSERT per match
+    now = datetime.now()
+    rows = [(player_id, int(field.group(1)), value, now)
+            for key, value in request.form.items() if (field := PREDICTION_FIELD.fullmatch(key))]
+
+    if rows:
+        if db.use_postgres:
+            psycopg2.extras.execute_values(cursor, '''
+                INSERT INTO predictions (player_id, match_id, prediction, updated_at)
+                VALUES %s
+                ON CONFLICT (player_id, match_id) DO UPDATE
+                SET prediction = EXCLUDED.prediction, updated_at = EXCLUDED.updated_at
+            ''', rows, page_size=100)
+        else:
+            # ON CONFLICT updates in place; INSERT OR REPLACE would delete the row,
+            # losing its id, created_at and points_earned
+            cursor.executemany('''
+                INSERT INTO predictions (player_id, match_id, prediction, updated_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (player_id, match_id) DO UPDATE
+                SET prediction = excluded.prediction, updated_at = excluded.updated_at
+            ''', rows)
+
+    predictions_count = len(rows)
+    
+    # A prediction posted after its result was stored (e.g. from a stale page) is scored
+    # here, as ingest only rescores when a result changes; cheap for unplayed gameweeks
+    if rows:
+        db.calculate_points_for_gameweek(game_week, conn=conn)
+        # Don't keep serving totals computed before this submission
+        db.bump_data_version(cursor)
+
     conn.commit()
-    conn.close()
+    db.put_connection(conn)
     
     flash(f'Predictions submitted successfully! ({predictions_count} predictions saved)')
     return redirect(url_for('prediction_summary', player_id=player_id, game_week=game_week))
@@ -570,7 +887,7 @@ def submit_predictions():
 @app.route('/summary/<int:player_id>/<int:game_week>')
 def prediction_summary(player_id, game_week):
     """Show what the player predicted"""
-    conn = db.get_connection()
+    conn = db.get_read_connection()
     cursor = conn.cursor()
     
     # Get player info
@@ -582,15 +899,14 @@ def prediction_summary(player_id, game_week):
     player = cursor.fetchone()
     
     if not player:
+        db.put_connection(conn)
         flash('Player not found')
         return redirect(url_for('home'))
     
-    # Get predictions with match details - FORMAT DATETIME FOR POSTGRES
+    # Get predictions with match details (dates are formatted by the kickoff filter)
     if db.use_postgres:
         cursor.execute('''
-            SELECT m.home_team, m.away_team, 
-                   TO_CHAR(m.match_date, 'YYYY-MM-DD HH24:MI') as match_date_str, 
-                   p.prediction
+            SELECT m.home_team, m.away_team, m.match_date, p.prediction
             FROM matches m
             JOIN predictions p ON m.id = p.match_id
             WHERE p.player_id = %s AND m.game_week = %s
@@ -606,7 +922,7 @@ def prediction_summary(player_id, game_week):
         ''', (player_id, game_week))
     
     predictions = cursor.fetchall()
-    conn.close()
+    db.put_connection(conn)
     
     return render_template('summary.html', 
                          player=player, 
@@ -620,6 +936,7 @@ def results_home():
     return render_template('results_home.html')
 
 @app.route('/results/weekly/<int:game_week>')
+@cache.cached(timeout=60, key_prefix=results_cache_key, unless=has_pending_flash)
 def weekly_results(game_week):
     """Weekly results for a specific gameweek"""
     # Always refresh match data before showing results
@@ -635,12 +952,9 @@ def weekly_results(game_week):
                          cumulative_results=cumulative_results)
 
 @app.route('/results/leaderboard')
+@cache.cached(timeout=60, key_prefix=results_cache_key, unless=has_pending_flash)
 def leaderboard():
     """Overall leaderboard"""
-    # Auto-calculate points for all gameweeks before showing leaderboard
-    for game_week in range(1, 39):  # Calculate for all possible gameweeks
-        db.calculate_points_for_gameweek(game_week)
-    
     results = db.get_overall_leaderboard()
     return render_template('leaderboard.html', results=results)
 
@@ -702,6 +1016,6 @@ def force_refresh(gameweek):
     
 
 if __name__ == '__main__':
-    # Use PORT environment variable for production
+    # Development server; production runs under gunicorn (see gunicorn.conf.py)
     port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port, debug=False)
\ No newline at end of file
+    create_app().run(host='0.0.0.0', port=port, debug=False)
\ No newline at end of file
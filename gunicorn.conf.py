@@ -0,0 +1,15 @@
+# Production server: gunicorn -c gunicorn.conf.py
+import os
+
+wsgi_app = 'app:create_app()'
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+
+# gevent workers keep serving other requests while one waits on the football-data.org API.
+# Greenlets beyond a worker's DB_POOL_SIZE (default 10) PostgreSQL connections queue for one,
+# and workers x DB_POOL_SIZE must stay under the database's max_connections.
+worker_class = 'gevent'
+workers = int(os.environ.get('WEB_CONCURRENCY', 4))
+worker_connections = 100
+
+# Tells app.py to monkey-patch (and make psycopg2 cooperative) before its imports
+raw_env = ['GEVENT=1']